@@ -3,25 +3,55 @@ APP COMPLETA INTEGRADA - FAISS + OFERTAS
 Para reemplazar completamente la app actual
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import datetime
-import uuid
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel, ValidationError
+import ahocorasick
+import asyncio
+import json
 import logging
-from typing import Optional, Dict, List
+import msgspec
+import orjson
+import os
+import re
+import threading
+import time
+from blake3 import blake3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple, Union
+
+# OpenMP (FAISS) en espera pasiva: los hilos ociosos no consumen CPU
+# compartida con los workers de Uvicorn
+os.environ.setdefault("OMP_WAIT_POLICY", "PASSIVE")
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class SafeORJSONResponse(ORJSONResponse):
+    """ORJSONResponse con respaldo al encoder estándar.
+
+    orjson rechaza enteros de más de 64 bits; en ese caso se serializa con
+    json como hacía JSONResponse en lugar de devolver un 500.
+    """
+
+    def render(self, content) -> bytes:
+        try:
+            return super().render(content)
+        except TypeError:
+            return JSONResponse.render(self, content)
+
 # Crear app FastAPI
 app = FastAPI(
     title="CHATIA-CAU-FAISS + Sistema de Ofertas Inteligente",
     description="API combinada: FAISS + Procesamiento automático de pliegos y generación de ofertas",
     version="2.0.0_integrated",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=SafeORJSONResponse
 )
 
 # Configurar CORS
@@ -33,14 +63,115 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Modelos Pydantic para Ofertas
-class PliegoRequest(BaseModel):
+# Modelo msgspec para procesarPliego: el pliego completo viaja en
+# rfp_content y se decodifica en C, sin validación Pydantic
+class PliegoRequest(msgspec.Struct):
+    rfp_content: str
+    rfp_name: Optional[str] = "pliego.pdf"
+    auto_generate: Optional[bool] = True
+    chunk_size: Optional[int] = 2000
+    chunk_overlap: Optional[int] = 200
+
+# Modelo Pydantic equivalente: solo se usa cuando msgspec rechaza el cuerpo,
+# para aceptar exactamente las mismas entradas que antes (2000.0 como int,
+# "yes" como bool...) y devolver los mismos errores 422
+class _PliegoRequestModel(BaseModel):
     rfp_content: str
     rfp_name: Optional[str] = "pliego.pdf"
     auto_generate: Optional[bool] = True
     chunk_size: Optional[int] = 2000
     chunk_overlap: Optional[int] = 200
 
+async def pliego_body(request: Request) -> PliegoRequest:
+    """Decodifica el cuerpo de procesarPliego directamente a PliegoRequest"""
+    body = await request.body()
+    try:
+        # strict: cualquier coerción (p. ej. "2000" -> 2000) la decide Pydantic
+        return msgspec.json.decode(body, type=PliegoRequest, strict=True)
+    except (msgspec.DecodeError, UnicodeDecodeError):
+        # msgspec.DecodeError incluye msgspec.ValidationError
+        pass
+
+    # Camino lento, el mismo que seguía FastAPI: json estándar (admite, p. ej.,
+    # surrogates sueltos que msgspec rechaza) y validación laxa de Pydantic
+    data = None
+    if body:
+        try:
+            data = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise RequestValidationError(
+                [{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}],
+                body=e.doc,
+            )
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="There was an error parsing the body")
+    if data is None:
+        missing = [{"type": "missing", "loc": ("body",), "input": None}]
+        raise RequestValidationError(ValidationError.from_exception_data("Field required", missing).errors())
+    try:
+        model = _PliegoRequestModel.model_validate(data, from_attributes=True)
+    except ValidationError as e:
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()], body=data)
+    return PliegoRequest(**model.model_dump())
+
+# Esquema para /docs, ya que el cuerpo no pasa por Pydantic
+_PLIEGO_REQUEST_SCHEMA = msgspec.json.schema(PliegoRequest)["$defs"]["PliegoRequest"]
+
+# Respuesta tipada de procesarPliego: se construye directamente y se
+# serializa con msgspec, sin pasar por jsonable_encoder
+class PliegoClassification(msgspec.Struct):
+    tipo_oferta: str
+    tipo_cliente: str
+    sector: str
+    confianza: float
+    objetivo_principal: str
+    productos_servicios: List[str]
+    normativas: List[str]
+
+class ChunksInfo(msgspec.Struct):
+    total_chunks: int
+    chunk_size: int
+    chunk_overlap: int
+    total_characters: int
+
+class AutoGenerationResult(msgspec.Struct):
+    status: str
+    message: str
+    generation_time: str
+    offer_sections: List[str]
+
+class ProcesarPliegoResponse(msgspec.Struct, omit_defaults=True):
+    offer_id: str
+    status: str
+    message: str
+    rfp_name: Optional[str]
+    classification: PliegoClassification
+    chunks_created: int
+    chunks_info: ChunksInfo
+    processing_time: str
+    platform: str
+    integration_status: str
+    timestamp: str
+    next_steps: List[str]
+    # Solo aparece en la respuesta si auto_generate está activo
+    auto_generation_result: Optional[AutoGenerationResult] = None
+
+class MsgspecResponse(Response):
+    """Respuesta JSON que serializa Structs con msgspec en una sola pasada"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return msgspec.json.encode(content)
+
+# Modelos Pydantic para FAISS
+class TextQuery(BaseModel):
+    text: str = ""
+
+class FaissSearchRequest(BaseModel):
+    text: Optional[str] = ""
+    queries: Optional[List[Union[str, TextQuery]]] = None
+
+# Modelos Pydantic para Ofertas
 class OfferRequest(BaseModel):
     offer_id: str
 
@@ -51,211 +182,559 @@ class FileRequest(BaseModel):
     offer_id: str
     file_type: Optional[str] = "oferta"
 
+# ============================================================================
+# UTILIDADES DE PROCESAMIENTO
+# ============================================================================
+
+# Reglas de clasificación por palabras clave, construidas una sola vez al
+# importar. Dentro de cada categoría gana la primera etiqueta de la lista
+# con alguna coincidencia.
+_CLASSIFICATION_RULES = {
+    "tipo_oferta": (
+        ("Cloud", frozenset({"cloud", "azure", "aws", "nube", "saas", "paas", "iaas"})),
+        ("Seguridad", frozenset({"seguridad", "ciberseguridad", "firewall", "antivirus", "ens", "esquema"})),
+        ("Telco", frozenset({"telco", "telecomunicaciones", "5g", "fibra", "red", "conectividad"})),
+    ),
+    "tipo_cliente": (
+        ("Público", frozenset({"administracion", "publico", "ayuntamiento", "ministerio", "junta", "diputacion"})),
+    ),
+    "sector": (
+        ("Salud", frozenset({"salud", "sanitario", "hospital", "clinica"})),
+        ("Educación", frozenset({"educacion", "universidad", "colegio", "formacion"})),
+        ("Financiero", frozenset({"financiero", "banco", "fintech", "seguros"})),
+        ("Industrial", frozenset({"industria", "manufacturing", "produccion"})),
+    ),
+}
+
+_CLASSIFICATION_DEFAULTS = {
+    "tipo_oferta": "DX",
+    "tipo_cliente": "Privado",
+    "sector": "General",
+}
+
+# palabra clave -> (categoría, prioridad, etiqueta)
+_KEYWORD_INDEX = {
+    keyword: (category, priority, label)
+    for category, rules in _CLASSIFICATION_RULES.items()
+    for priority, (label, keywords) in enumerate(rules)
+    for keyword in keywords
+}
+
+def _build_keyword_automaton() -> ahocorasick.Automaton:
+    """Construye el autómata Aho-Corasick con todas las palabras clave"""
+    automaton = ahocorasick.Automaton()
+    for keyword, tag in _KEYWORD_INDEX.items():
+        automaton.add_word(keyword, tag)
+    automaton.make_automaton()
+    return automaton
+
+# Un único recorrido del texto para todas las palabras clave (incluidas
+# coincidencias solapadas, igual que la búsqueda por subcadena)
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
+
+# El texto se pasa a minúsculas por ventanas para no duplicar el documento
+# completo en memoria. Las ventanas se solapan lo justo para no perder
+# palabras clave que crucen el borde.
+_SCAN_WINDOW = 65536
+_SCAN_OVERLAP = max(len(keyword) for keyword in _KEYWORD_INDEX) - 1
+
+def _clasificar(content: str) -> Dict[str, str]:
+    """Clasifica el pliego recorriendo el texto una sola vez"""
+    best = {}
+    for start in range(0, len(content), _SCAN_WINDOW):
+        window = content[start:start + _SCAN_WINDOW + _SCAN_OVERLAP].lower()
+        for _, (category, priority, label) in _KEYWORD_AUTOMATON.iter(window):
+            if category not in best or priority < best[category][0]:
+                best[category] = (priority, label)
+        # Todas las categorías resueltas con su etiqueta prioritaria: el resto
+        # del documento no se llega a leer
+        if len(best) == len(_CLASSIFICATION_RULES) and all(p == 0 for p, _ in best.values()):
+            break
+    return {
+        category: best[category][1] if category in best else default
+        for category, default in _CLASSIFICATION_DEFAULTS.items()
+    }
+
+# Minuto actual ya formateado: (inicio del minuto en epoch, "%Y%m%d%H%M" en UTC)
+_minute_stamp = (0, "")
+
+def _generar_offer_id(stamp: Optional[str] = None, now: Optional[float] = None) -> str:
+    """Genera un offer_id OFF-<8 hex>-<YYYYmmddHHMM> (UTC, como _now_iso).
+
+    El sufijo de fecha se formatea una vez por minuto y la parte aleatoria
+    usa 4 bytes de os.urandom en lugar de un UUID completo. now permite
+    reutilizar la hora ya leída por el handler.
+    """
+    global _minute_stamp
+    if stamp is None:
+        now = int(time.time() if now is None else now)
+        minute = now - now % 60
+        cached = _minute_stamp
+        if cached[0] != minute:
+            cached = (minute, time.strftime("%Y%m%d%H%M", time.gmtime(minute)))
+            _minute_stamp = cached
+        stamp = cached[1]
+    return f"OFF-{os.urandom(4).hex()}-{stamp}"
+
+# Segundo actual ya formateado: (epoch en segundos, ISO-8601 UTC)
+_second_stamp = (0, "")
+
+def _now_iso(now: Optional[float] = None) -> str:
+    """Timestamp ISO-8601 en UTC con resolución de segundo.
+
+    Se formatea como mucho una vez por segundo; el resto de llamadas
+    devuelven la cadena ya construida. now permite reutilizar la hora ya
+    leída por el handler.
+    """
+    global _second_stamp
+    now = int(time.time() if now is None else now)
+    cached = _second_stamp
+    if cached[0] != now:
+        cached = (now, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)))
+        _second_stamp = cached
+    return cached[1]
+
+_NON_BLANK = re.compile(r"\S")
+
+def _iter_chunks(content: str, chunk_size: int, overlap: int):
+    """Genera los metadatos de cada chunk sin copiar el texto.
+
+    Solo se calculan offsets; el contenido de un chunk se obtiene bajo
+    demanda con content[chunk["start_pos"]:chunk["end_pos"]].
+    """
+    total = len(content)
+    chunk_id = 0
+    for start in range(0, total, chunk_size - overlap):
+        end = min(start + chunk_size, total)
+        # Descarta ventanas vacías o solo con espacios (sin crear la subcadena)
+        if _NON_BLANK.search(content, start, end) is None:
+            continue
+        chunk_id += 1
+        yield {
+            "id": chunk_id,
+            "size": end - start,
+            "start_pos": start,
+            "end_pos": end
+        }
+
+# Caché LRU del análisis de pliegos: (hash del contenido, chunk_size,
+# overlap) -> (clasificación, número de chunks). Se guarda solo el hash,
+# nunca el texto del pliego.
+_ANALYSIS_CACHE_SIZE = 256
+_analysis_cache: "OrderedDict[tuple, Tuple[Dict[str, str], int]]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+def _hash_contenido(content: str) -> bytes:
+    """Hash de 16 bytes del pliego, codificado por ventanas de _SCAN_WINDOW.
+
+    UTF-8 codifica cada carácter por separado, así que el resultado es el
+    mismo que hashear el documento completo pero sin copiarlo entero.
+    """
+    hasher = blake3()
+    for start in range(0, len(content), _SCAN_WINDOW):
+        hasher.update(content[start:start + _SCAN_WINDOW].encode("utf-8", "surrogatepass"))
+    return hasher.digest(length=16)
+
+def _analizar_pliego(content: str, chunk_size: int, overlap: int) -> Tuple[Dict[str, str], int]:
+    """Clasificación y número de chunks de un pliego, cacheados por contenido.
+
+    El resultado es determinista, así que un pliego reenviado (habitual en
+    pruebas/UAT) se resuelve con un hash en lugar de volver a recorrerlo.
+    La clasificación devuelta es compartida y no debe modificarse.
+    """
+    key = (_hash_contenido(content), chunk_size, overlap)
+    with _analysis_cache_lock:
+        cached = _analysis_cache.get(key)
+        if cached is not None:
+            _analysis_cache.move_to_end(key)
+            return cached
+
+    classification = _clasificar(content)
+    total_chunks = sum(1 for _ in _iter_chunks(content, chunk_size, overlap))
+    result = (classification, total_chunks)
+
+    with _analysis_cache_lock:
+        _analysis_cache[key] = result
+        if len(_analysis_cache) > _ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+    return result
+
+class _MicroBatcher:
+    """Agrupa peticiones unitarias concurrentes en una sola llamada por lotes.
+
+    Cada petición deja (item, Future) en una cola; un worker en segundo plano
+    toma todo lo pendiente (hasta max_batch), invoca handler una vez con la
+    lista de items y resuelve cada Future con su resultado. Una petición
+    sola se despacha sin esperar: los lotes se forman con las peticiones que
+    llegan mientras la llamada anterior está en curso.
+    """
+
+    def __init__(self, handler, max_batch: int = 64):
+        self._handler = handler
+        self._max_batch = max_batch
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        # El worker se arranca bajo demanda en el loop que atiende la petición
+        if self._loop is not loop or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run(self._queue))
+        future = loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self._max_batch:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            try:
+                results = await self._handler([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"El lote devolvió {len(results)} resultados para {len(batch)} peticiones"
+                    )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+# ============================================================================
+# RESPUESTAS PRECALCULADAS
+# ============================================================================
+
+_TIMESTAMP_SLOT = "__timestamp__"
+
+def _json_static(payload: dict) -> bytes:
+    """Serializa una sola vez un payload constante"""
+    return orjson.dumps(payload)
+
+def _json_template(payload: dict) -> Tuple[bytes, bytes]:
+    """Serializa un payload constante dejando un hueco para el timestamp.
+
+    Devuelve (prefijo, sufijo) para que cada petición solo tenga que
+    concatenar el timestamp actual.
+    """
+    prefix, suffix = orjson.dumps(payload).split(orjson.dumps(_TIMESTAMP_SLOT))
+    return prefix, suffix
+
+def _json_response(body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Devuelve un cuerpo JSON ya serializado sin pasar por el encoder"""
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _timestamped_response(template: Tuple[bytes, bytes], headers: Optional[Dict[str, str]] = None) -> Response:
+    """Completa una plantilla de _json_template con el timestamp actual"""
+    prefix, suffix = template
+    return _json_response(prefix + orjson.dumps(_now_iso()) + suffix, headers)
+
+# ============================================================================
+# CACHÉ HTTP (ETag / Cache-Control)
+# ============================================================================
+
+_CACHE_MAX_AGE = 30
+
+# Versión de los datos de listarOfertas: cambiarla invalida los ETag emitidos
+_OFERTAS_DATA_VERSION = "1"
+
+# Los health checks y el ping nunca se cachean: un proxy no debe responder
+# por un worker caído
+_NO_STORE_HEADERS = {"Cache-Control": "no-store"}
+
+def _etag(*parts: bytes, weak: bool = False) -> str:
+    """ETag a partir del contenido estable de una respuesta.
+
+    Solo es fuerte si el cuerpo es idéntico byte a byte; las respuestas con
+    timestamp o datos generados por petición usan un ETag débil (W/).
+    """
+    tag = '"' + blake3(b"\0".join(parts)).hexdigest(length=8) + '"'
+    return "W/" + tag if weak else tag
+
+def _cache_headers(etag: str) -> Dict[str, str]:
+    """Cabeceras para que el proxy de App Service / CDN pueda cachear"""
+    return {"ETag": etag, "Cache-Control": f"public, max-age={_CACHE_MAX_AGE}"}
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Devuelve un 304 si el cliente ya tiene la versión identificada por etag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    opaque = etag.removeprefix("W/")
+    tags = [tag.strip() for tag in header.split(",")]
+    if "*" in tags or any(tag.removeprefix("W/") == opaque for tag in tags):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    return None
+
+def _cached_json_response(request: Request, etag: str, body: bytes) -> Response:
+    """Respuesta cacheable para un cuerpo JSON constante"""
+    return _not_modified(request, etag) or _json_response(body, _cache_headers(etag))
+
 # ============================================================================
 # ENDPOINTS PRINCIPALES
 # ============================================================================
 
+_ROOT_JSON = _json_static({
+    "message": "CHATIA-CAU-FAISS + Sistema de Ofertas Inteligente",
+    "version": "2.0.0_integrated",
+    "platform": "Azure App Service",
+    "status": "operational",
+    "services": {
+        "faiss": "Vector similarity search",
+        "ofertas": "Intelligent offer generation"
+    },
+    "docs": "/docs",
+    "endpoints": {
+        "faiss": [
+            "/faiss/health",
+            "/faiss/search"
+        ],
+        "ofertas": [
+            "/api/ofertas/ping",
+            "/api/ofertas/procesarPliego",
+            "/api/ofertas/generarOferta",
+            "/api/ofertas/obtenerEstadoOferta",
+            "/api/ofertas/listarOfertas",
+            "/api/ofertas/recuperaFichero"
+        ]
+    }
+})
+_ROOT_ETAG = _etag(_ROOT_JSON)
+
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Página principal combinada"""
-    return {
-        "message": "CHATIA-CAU-FAISS + Sistema de Ofertas Inteligente",
-        "version": "2.0.0_integrated",
-        "platform": "Azure App Service",
-        "status": "operational",
-        "services": {
-            "faiss": "Vector similarity search",
-            "ofertas": "Intelligent offer generation"
-        },
-        "docs": "/docs",
-        "endpoints": {
-            "faiss": [
-                "/faiss/health",
-                "/faiss/search"
-            ],
-            "ofertas": [
-                "/api/ofertas/ping",
-                "/api/ofertas/procesarPliego",
-                "/api/ofertas/generarOferta",
-                "/api/ofertas/obtenerEstadoOferta",
-                "/api/ofertas/listarOfertas",
-                "/api/ofertas/recuperaFichero"
-            ]
-        }
+    return _cached_json_response(request, _ROOT_ETAG, _ROOT_JSON)
+
+_HEALTH_JSON = _json_template({
+    "status": "healthy",
+    "timestamp": _TIMESTAMP_SLOT,
+    "platform": "App Service Integrated",
+    "services": {
+        "faiss": "active",
+        "ofertas": "active"
     }
+})
 
 @app.get("/health")
 async def health_check():
     """Health check general"""
-    return {
-        "status": "healthy",
-        "timestamp": datetime.datetime.now().isoformat(),
-        "platform": "App Service Integrated",
-        "services": {
-            "faiss": "active",
-            "ofertas": "active"
-        }
-    }
+    return _timestamped_response(_HEALTH_JSON, _NO_STORE_HEADERS)
 
 # ============================================================================
 # ENDPOINTS FAISS (SIMULADOS - MANTENER COMPATIBILIDAD)
 # ============================================================================
 
+_FAISS_HEALTH_JSON = _json_template({
+    "status": "healthy",
+    "service": "faiss",
+    "message": "FAISS service operational",
+    "timestamp": _TIMESTAMP_SLOT
+})
+
 @app.get("/faiss/health")
 async def faiss_health():
     """Health check FAISS"""
-    return {
-        "status": "healthy",
-        "service": "faiss",
-        "message": "FAISS service operational",
-        "timestamp": datetime.datetime.now().isoformat()
-    }
+    return _timestamped_response(_FAISS_HEALTH_JSON, _NO_STORE_HEADERS)
 
-@app.post("/faiss/search")
-async def faiss_search(query: dict):
-    """Búsqueda FAISS simulada"""
-    return {
-        "status": "success",
-        "message": "FAISS search completed",
-        "query": query.get("text", ""),
-        "results": [
+async def _buscar_faiss_lote(texts: List[str]) -> List[List[dict]]:
+    """Búsqueda FAISS simulada para un lote de consultas.
+
+    Con FAISS real, aquí se codifican todos los textos en una única matriz
+    float32 contigua (N x d) y se hace una sola llamada index.search(xq, k)
+    fuera del event loop.
+    """
+    return [
+        [
             {"id": 1, "score": 0.95, "text": "Resultado simulado 1"},
             {"id": 2, "score": 0.87, "text": "Resultado simulado 2"}
-        ],
-        "timestamp": datetime.datetime.now().isoformat()
-    }
+        ]
+        for _ in texts
+    ]
+
+# Consultas unitarias concurrentes -> una sola búsqueda por lotes. Sin
+# ventana de espera fija: una consulta sola se busca al momento y solo se
+# agrupan las que llegan mientras hay una búsqueda en curso
+_faiss_batcher = _MicroBatcher(_buscar_faiss_lote, max_batch=64)
+
+@app.post("/faiss/search")
+async def faiss_search(query: Union[FaissSearchRequest, List[str]]):
+    """Búsqueda FAISS simulada.
+
+    Acepta {"text": ...} (consulta unitaria), una lista de textos o
+    {"queries": [...]} con textos o {"text": ...}.
+    """
+    try:
+        if isinstance(query, FaissSearchRequest) and query.queries is None:
+            return {
+                "status": "success",
+                "message": "FAISS search completed",
+                "query": query.text,
+                "results": await _faiss_batcher.submit(query.text),
+                "timestamp": _now_iso()
+            }
+
+        queries = query.queries if isinstance(query, FaissSearchRequest) else query
+        texts = [q.text if isinstance(q, TextQuery) else q for q in queries]
+        return {
+            "status": "success",
+            "message": "FAISS search completed",
+            "queries": texts,
+            "results": await _buscar_faiss_lote(texts),
+            "timestamp": _now_iso()
+        }
+        
+    except Exception as e:
+        logger.error(f"Error en búsqueda FAISS: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 # ============================================================================
 # ENDPOINTS OFERTAS
 # ============================================================================
 
+# Fragmentos comunes a las respuestas de ofertas (se reutilizan, no se
+# reconstruyen en cada petición)
+_PLATFORM = "App Service Integrado (FAISS + Ofertas)"
+_COMMON_TAIL = {"platform": _PLATFORM, "integration_status": "Active"}
+
+_PRODUCTOS_SERVICIOS = ["Consultoría", "Implementación", "Soporte"]
+_NORMATIVAS_PUBLICO = ["RGPD", "ENS"]
+_NORMATIVAS_PRIVADO = ["RGPD"]
+
+_NEXT_STEPS = [
+    "Pliego dividido en chunks inteligentes",
+    "Clasificación automática completada",
+    "Listo para generación de oferta",
+    "Compatible con búsqueda FAISS"
+]
+
+_AUTO_GENERATION_RESULT = AutoGenerationResult(
+    status="success",
+    message="Oferta generada automáticamente",
+    generation_time="< 3 segundos",
+    offer_sections=[
+        "Resumen ejecutivo",
+        "Análisis de requisitos",
+        "Propuesta técnica",
+        "Metodología",
+        "Equipo y recursos",
+        "Cronograma",
+        "Presupuesto"
+    ]
+)
+
+_GENERATION_DETAILS = [
+    "Análisis de chunks del pliego original",
+    "Aplicación de plantilla específica por categoría",
+    "Generación de contenido con IA siguiendo las 3 partes",
+    "Ensamblado de oferta final en formato profesional"
+]
+
+_PING_JSON = _json_template({
+    "status": "ok",
+    "message": "Sistema de ofertas inteligente operativo",
+    "version": "v2.0_integrated",
+    "platform": "Azure App Service (chatia-cau-faiss)",
+    "integration": "FAISS + Ofertas",
+    "advantages": [
+        "Sin cold starts",
+        "Siempre activo", 
+        "Respuesta instantánea",
+        "Integrado con FAISS"
+    ],
+    "timestamp": _TIMESTAMP_SLOT
+})
+
 @app.get("/api/ofertas/ping")
 async def ping_ofertas():
     """Test de conectividad del sistema de ofertas"""
-    return {
-        "status": "ok",
-        "message": "Sistema de ofertas inteligente operativo",
-        "version": "v2.0_integrated",
-        "platform": "Azure App Service (chatia-cau-faiss)",
-        "integration": "FAISS + Ofertas",
-        "advantages": [
-            "Sin cold starts",
-            "Siempre activo", 
-            "Respuesta instantánea",
-            "Integrado con FAISS"
-        ],
-        "timestamp": datetime.datetime.now().isoformat()
-    }
+    return _timestamped_response(_PING_JSON, _NO_STORE_HEADERS)
+
+# Pool propio para procesarPliego: como mucho un pliego por CPU a la vez,
+# sin ocupar el pool por defecto ni depender del event loop en curso
+_CPU_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="pliego")
+
+def _procesar_pliego_sync(request: PliegoRequest) -> ProcesarPliegoResponse:
+    """Parte CPU de procesarPliego: se ejecuta fuera del event loop"""
+    # Una sola lectura del reloj para el ID y el timestamp
+    now = time.time()
+    ts = _now_iso(now)
+    
+    # Generar ID único
+    offer_id = _generar_offer_id(now=now)
+    
+    # Clasificación por palabras clave y chunking inteligente (cacheados)
+    chunk_size = request.chunk_size or 2000
+    overlap = request.chunk_overlap or 200
+    classification, total_chunks = _analizar_pliego(request.rfp_content, chunk_size, overlap)
+    tipo_oferta = classification["tipo_oferta"]
+    tipo_cliente = classification["tipo_cliente"]
+    sector = classification["sector"]
+    
+    # Resultado del procesamiento
+    result = ProcesarPliegoResponse(
+        offer_id=offer_id,
+        status="success",
+        message="Pliego procesado correctamente (FAISS + Ofertas Integrado)",
+        rfp_name=request.rfp_name,
+        classification=PliegoClassification(
+            tipo_oferta=tipo_oferta,
+            tipo_cliente=tipo_cliente,
+            sector=sector,
+            confianza=0.9,
+            objetivo_principal="Transformación digital y modernización",
+            productos_servicios=_PRODUCTOS_SERVICIOS,
+            normativas=_NORMATIVAS_PUBLICO if tipo_cliente == "Público" else _NORMATIVAS_PRIVADO
+        ),
+        chunks_created=total_chunks,
+        chunks_info=ChunksInfo(
+            total_chunks=total_chunks,
+            chunk_size=chunk_size,
+            chunk_overlap=overlap,
+            total_characters=len(request.rfp_content)
+        ),
+        processing_time="< 1 segundo",
+        **_COMMON_TAIL,
+        timestamp=ts,
+        next_steps=_NEXT_STEPS,
+        # Generación automática si se solicita
+        auto_generation_result=_AUTO_GENERATION_RESULT if request.auto_generate else None
+    )
+    
+    logger.info(f"Pliego procesado (integrado): {offer_id}")
+    return result
 
-@app.post("/api/ofertas/procesarPliego")
-async def procesar_pliego(request: PliegoRequest):
+@app.post(
+    "/api/ofertas/procesarPliego",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": _PLIEGO_REQUEST_SCHEMA}}
+        }
+    },
+    response_class=MsgspecResponse
+)
+async def procesar_pliego(request: PliegoRequest = Depends(pliego_body)):
     """Procesa un pliego - VERSIÓN INTEGRADA"""
     try:
         logger.info("=== PROCESAR PLIEGO INTEGRADO ===")
         
-        # Generar ID único
-        offer_id = f"OFF-{uuid.uuid4().hex[:8]}-{datetime.datetime.now().strftime('%Y%m%d%H%M')}"
-        
-        # Clasificación inteligente por palabras clave
-        content_lower = request.rfp_content.lower()
-        
-        # Detección avanzada de tipo de oferta
-        if any(word in content_lower for word in ["cloud", "azure", "aws", "nube", "saas", "paas", "iaas"]):
-            tipo_oferta = "Cloud"
-        elif any(word in content_lower for word in ["seguridad", "ciberseguridad", "firewall", "antivirus", "ens", "esquema"]):
-            tipo_oferta = "Seguridad"
-        elif any(word in content_lower for word in ["telco", "telecomunicaciones", "5g", "fibra", "red", "conectividad"]):
-            tipo_oferta = "Telco"
-        else:
-            tipo_oferta = "DX"
-        
-        # Detección de tipo de cliente
-        if any(word in content_lower for word in ["administracion", "publico", "ayuntamiento", "ministerio", "junta", "diputacion"]):
-            tipo_cliente = "Público"
-        else:
-            tipo_cliente = "Privado"
-        
-        # Detección de sector
-        if any(word in content_lower for word in ["salud", "sanitario", "hospital", "clinica"]):
-            sector = "Salud"
-        elif any(word in content_lower for word in ["educacion", "universidad", "colegio", "formacion"]):
-            sector = "Educación"
-        elif any(word in content_lower for word in ["financiero", "banco", "fintech", "seguros"]):
-            sector = "Financiero"
-        elif any(word in content_lower for word in ["industria", "manufacturing", "produccion"]):
-            sector = "Industrial"
-        else:
-            sector = "General"
-        
-        # Chunking inteligente
-        chunks = []
-        chunk_size = request.chunk_size or 2000
-        overlap = request.chunk_overlap or 200
-        
-        for i in range(0, len(request.rfp_content), chunk_size - overlap):
-            chunk_content = request.rfp_content[i:i+chunk_size]
-            if chunk_content.strip():
-                chunks.append({
-                    "id": len(chunks) + 1,
-                    "content": chunk_content,
-                    "size": len(chunk_content),
-                    "start_pos": i,
-                    "end_pos": min(i + chunk_size, len(request.rfp_content))
-                })
-        
-        # Resultado del procesamiento
-        result = {
-            "offer_id": offer_id,
-            "status": "success",
-            "message": "Pliego procesado correctamente (FAISS + Ofertas Integrado)",
-            "rfp_name": request.rfp_name,
-            "classification": {
-                "tipo_oferta": tipo_oferta,
-                "tipo_cliente": tipo_cliente,
-                "sector": sector,
-                "confianza": 0.9,
-                "objetivo_principal": "Transformación digital y modernización",
-                "productos_servicios": ["Consultoría", "Implementación", "Soporte"],
-                "normativas": ["RGPD", "ENS"] if tipo_cliente == "Público" else ["RGPD"]
-            },
-            "chunks_created": len(chunks),
-            "chunks_info": {
-                "total_chunks": len(chunks),
-                "chunk_size": chunk_size,
-                "chunk_overlap": overlap,
-                "total_characters": len(request.rfp_content)
-            },
-            "processing_time": "< 1 segundo",
-            "platform": "App Service Integrado (FAISS + Ofertas)",
-            "integration_status": "Active",
-            "timestamp": datetime.datetime.now().isoformat(),
-            "next_steps": [
-                "Pliego dividido en chunks inteligentes",
-                "Clasificación automática completada", 
-                "Listo para generación de oferta",
-                "Compatible con búsqueda FAISS"
-            ]
-        }
-        
-        # Generación automática si se solicita
-        if request.auto_generate:
-            result["auto_generation_result"] = {
-                "status": "success",
-                "message": "Oferta generada automáticamente",
-                "generation_time": "< 3 segundos",
-                "offer_sections": [
-                    "Resumen ejecutivo",
-                    "Análisis de requisitos", 
-                    "Propuesta técnica",
-                    "Metodología",
-                    "Equipo y recursos",
-                    "Cronograma",
-                    "Presupuesto"
-                ]
-            }
-        
-        logger.info(f"Pliego procesado (integrado): {offer_id}")
-        return result
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_CPU_EXECUTOR, _procesar_pliego_sync, request)
+        # Devolver la respuesta ya construida evita jsonable_encoder
+        return MsgspecResponse(result)
         
     except Exception as e:
         logger.error(f"Error procesando pliego: {str(e)}")
@@ -281,16 +760,10 @@ async def generar_oferta(request: OfferRequest):
                 "presupuesto": "Presupuesto competitivo y ajustado con desglose detallado",
                 "valor_añadido": "Aceleradores propios, benchmarking y métricas de impacto"
             },
-            "generation_details": [
-                "Análisis de chunks del pliego original",
-                "Aplicación de plantilla específica por categoría",
-                "Generación de contenido con IA siguiendo las 3 partes",
-                "Ensamblado de oferta final en formato profesional"
-            ],
+            "generation_details": _GENERATION_DETAILS,
             "generation_time": "< 5 segundos",
-            "platform": "App Service Integrado (FAISS + Ofertas)",
-            "integration_status": "Active",
-            "timestamp": datetime.datetime.now().isoformat()
+            **_COMMON_TAIL,
+            "timestamp": _now_iso()
         }
         
         logger.info(f"Oferta generada (integrada): {request.offer_id}")
@@ -300,29 +773,57 @@ async def generar_oferta(request: OfferRequest):
         logger.error(f"Error generando oferta: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+_DEFAULT_CLASSIFICATION = {
+    "tipo_oferta": "DX",
+    "tipo_cliente": "Público",
+    "sector": "General"
+}
+
+async def _cargar_metadatos_ofertas(offer_ids: List[str]) -> List[dict]:
+    """Metadatos simulados de un lote de ofertas, en el mismo orden.
+
+    Con el almacén real, aquí se hace una única consulta get_many(offer_ids)
+    en lugar de un round-trip por oferta. El almacén simulado no guarda
+    fechas (None): el handler usa la hora de la petición, leída una vez.
+    """
+    return [
+        {
+            "classification": _DEFAULT_CLASSIFICATION,
+            "processing_date": None,
+            "total_chunks": 5,
+            "chunks_saved": True,
+            "final_offer_available": True,
+            "file_exists": True,
+            "file_size_estimate": 15000,
+            "last_modified": None
+        }
+        for _ in offer_ids
+    ]
+
+# Consultas unitarias por offer_id -> una sola lectura por lotes del almacén
+_offer_metadata_batcher = _MicroBatcher(_cargar_metadatos_ofertas, max_batch=64)
+
 @app.post("/api/ofertas/obtenerEstadoOferta")
 async def obtener_estado_oferta(request: StatusRequest):
     """Obtiene estado detallado de una oferta"""
     try:
         logger.info(f"=== OBTENER ESTADO INTEGRADO: {request.offer_id} ===")
         
+        metadata = await _offer_metadata_batcher.submit(request.offer_id)
+        ts = _now_iso()
+        
         result = {
             "offer_id": request.offer_id,
             "status": "completed",
             "message": "Estado de oferta obtenido correctamente (FAISS + Ofertas)",
-            "classification": {
-                "tipo_oferta": "DX",
-                "tipo_cliente": "Público",
-                "sector": "General"
-            },
-            "processing_date": datetime.datetime.now().isoformat(),
+            "classification": metadata["classification"],
+            "processing_date": metadata["processing_date"] or ts,
             "chunks_info": {
-                "total_chunks": 5,
-                "chunks_saved": True
+                "total_chunks": metadata["total_chunks"],
+                "chunks_saved": metadata["chunks_saved"]
             },
-            "final_offer_available": True,
-            "platform": "App Service Integrado (FAISS + Ofertas)",
-            "integration_status": "Active"
+            "final_offer_available": metadata["final_offer_available"],
+            **_COMMON_TAIL
         }
         
         return result
@@ -332,28 +833,38 @@ async def obtener_estado_oferta(request: StatusRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/ofertas/listarOfertas")
-async def listar_ofertas(limit: int = 20, offset: int = 0):
+async def listar_ofertas(request: Request, response: Response, limit: int = 20, offset: int = 0):
     """Lista ofertas disponibles con paginación"""
     try:
         logger.info(f"=== LISTAR OFERTAS INTEGRADO: limit={limit}, offset={offset} ===")
         
+        # La página solo depende de (limit, offset, versión de los datos); el
+        # cuerpo lleva IDs y fechas generados por petición, así que el ETag es débil
+        etag = _etag(f"{limit}:{offset}:{_OFERTAS_DATA_VERSION}".encode(), weak=True)
+        not_modified = _not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        response.headers.update(_cache_headers(etag))
+        
+        ts = _now_iso()
+        
         # Simular lista de ofertas
         ofertas_ejemplo = [
             {
-                "offer_id": f"OFF-{uuid.uuid4().hex[:8]}-202412151200",
+                "offer_id": _generar_offer_id("202412151200"),
                 "rfp_name": "Pliego_Transformacion_Digital.pdf",
                 "status": "completed",
                 "tipo_oferta": "DX",
                 "tipo_cliente": "Público",
-                "created_date": datetime.datetime.now().isoformat()
+                "created_date": ts
             },
             {
-                "offer_id": f"OFF-{uuid.uuid4().hex[:8]}-202412141500",
+                "offer_id": _generar_offer_id("202412141500"),
                 "rfp_name": "Pliego_Cloud_Migration.pdf", 
                 "status": "processed",
                 "tipo_oferta": "Cloud",
                 "tipo_cliente": "Privado",
-                "created_date": datetime.datetime.now().isoformat()
+                "created_date": ts
             }
         ]
         
@@ -367,8 +878,7 @@ async def listar_ofertas(limit: int = 20, offset: int = 0):
                 "offset": offset,
                 "has_more": offset + limit < len(ofertas_ejemplo)
             },
-            "platform": "App Service Integrado (FAISS + Ofertas)",
-            "integration_status": "Active"
+            **_COMMON_TAIL
         }
         
         return result
@@ -383,6 +893,9 @@ async def recupera_fichero(request: FileRequest):
     try:
         logger.info(f"=== RECUPERAR FICHERO INTEGRADO: {request.offer_id}, tipo: {request.file_type} ===")
         
+        metadata = await _offer_metadata_batcher.submit(request.offer_id)
+        ts = _now_iso()
+        
         result = {
             "offer_id": request.offer_id,
             "status": "success",
@@ -390,14 +903,13 @@ async def recupera_fichero(request: FileRequest):
             "file_info": {
                 "filename": f"oferta_{request.offer_id}.md",
                 "file_type": request.file_type,
-                "exists": True,
-                "size_estimate": 15000,
-                "download_available": True,
-                "last_modified": datetime.datetime.now().isoformat()
+                "exists": metadata["file_exists"],
+                "size_estimate": metadata["file_size_estimate"],
+                "download_available": metadata["final_offer_available"],
+                "last_modified": metadata["last_modified"] or ts
             },
-            "platform": "App Service Integrado (FAISS + Ofertas)",
-            "integration_status": "Active",
-            "timestamp": datetime.datetime.now().isoformat()
+            **_COMMON_TAIL,
+            "timestamp": ts
         }
         
         return result
@@ -412,4 +924,12 @@ async def recupera_fichero(request: FileRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="uvloop",
+        http="httptools",
+        log_level="warning"
+    )